@@ -40,6 +40,18 @@ Feature: Docker commands in new projects
     Then I should get a successful exit code
     And A new docker image for test project should be created
 
+  Scenario: Execute docker build with a cache source
+    Given I have executed the kedro command "docker build"
+    When I execute the kedro command "docker build --cache-from project-dummy"
+    Then I should get a successful exit code
+    And A new docker image for test project should be created
+
+  Scenario: Execute docker build with a missing cache source
+    Given I have removed old docker image of test project
+    When I execute the kedro command "docker build --cache-from project-dummy-missing"
+    Then I should get a successful exit code
+    And A new docker image for test project should be created
+
   Scenario: Execute docker run target successfully
     Given I have executed the kedro command "docker build"
     When I execute the kedro command "docker run"
@@ -103,6 +115,95 @@ Feature: Docker commands in new projects
     When I execute the kedro command "docker cmd kedro non-existent"
     Then Standard error should contain a message including "Error: No such command "non-existent""
 
+  Scenario: Execute several steps in one docker container
+    Given I have executed the kedro command "docker build"
+    When I execute the kedro command "docker cmd --step 'kedro test' --step 'kedro run'"
+    Then I should get a successful exit code
+    And I should get a message including "2 passed"
+    And I should get a message including "kedro.runner.sequential_runner - INFO - Pipeline execution completed successfully"
+
+  Scenario: Stop executing steps after a failure
+    Given I have executed the kedro command "docker build"
+    When I execute the kedro command "docker cmd --step 'kedro non-existent' --step 'kedro run'"
+    Then I should get an error exit code
+    And Standard error should contain a message including "Error: No such command "non-existent""
+
+  Scenario: Execute docker cmd with both steps and a command
+    Given I have executed the kedro command "docker build"
+    When I execute the kedro command "docker cmd --step 'kedro test' kedro run"
+    Then I should get an error exit code
+    And Standard error should contain a message including "`--step` options cannot be combined with ARGS."
+
+  Scenario: Execute several steps in a session container
+    Given I have executed the kedro command "docker build"
+    When I execute the kedro command "docker cmd --session --step 'kedro test' --step 'kedro run'"
+    Then I should get a successful exit code
+    And I should get a message including "2 passed"
+
+  Scenario: Execute docker cmd in a session container
+    Given I have executed the kedro command "docker build"
+    When I execute the kedro command "docker cmd --session kedro test"
+    Then I should get a successful exit code
+    And A docker container "project-dummy-session" should be running
+    And I should get a message including "2 passed"
+
+  Scenario: Reuse the session container
+    Given I have executed the kedro command "docker build"
+    And I have executed the kedro command "docker cmd --session kedro test"
+    When I execute the kedro command "docker run --session"
+    Then I should get a successful exit code
+    And I should get a message including "kedro.runner.sequential_runner - INFO - Pipeline execution completed successfully"
+
+  Scenario: Recreate the session container after rebuilding the image
+    Given I have executed the kedro command "docker build"
+    And I have executed the kedro command "docker cmd --session kedro test"
+    And I have executed the kedro command "docker build --uid 10001 --gid 20002"
+    When I execute the kedro command "docker cmd --session id -u"
+    Then I should get a successful exit code
+    And I should get a message including "10001"
+
+  Scenario: Execute docker cmd in a session container with a custom name
+    Given I have executed the kedro command "docker build"
+    When I execute the kedro command "docker cmd --session --docker-args=--name=custom kedro test"
+    Then I should get an error exit code
+    And Standard error should contain a message including "`--name` cannot be passed in `--docker-args` together with `--session`"
+
+  Scenario: Execute several commands with docker batch
+    Given I have executed the kedro command "docker build"
+    And I have prepared a batch file "batch.txt" with:
+      """
+      # run the tests and the pipeline at the same time
+      kedro test
+
+      kedro run --runner 'SequentialRunner'  # quoted argument
+      """
+    When I execute the kedro command "docker batch batch.txt"
+    Then I should get a successful exit code
+    And I should get a message including "2 passed"
+    And I should get a message including "kedro.runner.sequential_runner - INFO - Pipeline execution completed successfully"
+
+  Scenario: Execute docker batch with a failing command
+    Given I have executed the kedro command "docker build"
+    And I have prepared a batch file "batch.txt" with:
+      """
+      kedro test
+      kedro non-existent
+      """
+    When I execute the kedro command "docker batch batch.txt"
+    Then I should get an error exit code
+    And Standard error should contain a message including "The following commands have failed:"
+    And Standard error should contain a message including "kedro non-existent"
+
+  Scenario: Execute docker batch with a custom container name
+    Given I have executed the kedro command "docker build"
+    And I have prepared a batch file "batch.txt" with:
+      """
+      kedro test
+      """
+    When I execute the kedro command "docker batch batch.txt --docker-args=--name=custom"
+    Then I should get an error exit code
+    And Standard error should contain a message including "`--name` cannot be passed in `--docker-args` together with `kedro docker batch`"
+
   Scenario: Execute docker ipython target
     Given I have executed the kedro command "docker build"
     When I execute the kedro command "docker ipython"
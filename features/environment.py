@@ -31,11 +31,21 @@
 import os
 import shutil
 import stat
+import sys
 import tempfile
 from pathlib import Path
+from time import time
 
 from features.steps.sh_run import run
-from features.steps.util import create_new_venv, docker_prune, kill_docker_containers
+from features.steps.util import (
+    E2E_CACHE_DIR,
+    create_new_venv,
+    docker_prune,
+    get_requirements_hash,
+    kill_docker_containers,
+)
+
+COMPILED_REQUIREMENTS_TTL = 24 * 60 * 60  # seconds
 
 
 def before_all(context):
@@ -51,9 +61,17 @@ def before_all(context):
             print(res.stderr)
         assert not res.returncode
 
-    # make a venv
+    # spawn a trivial process once, so that subprocess machinery is warmed up
+    # before the first timed scenario
+    run([sys.executable, "-c", "pass"])
+
+    # make a venv, the scenarios install project requirements into it,
+    # so it's only reused between runs if E2E_CACHE_VENV is set
     if "E2E_VENV" in os.environ:
         context.venv_dir = Path(os.environ["E2E_VENV"])
+    elif os.environ.get("E2E_CACHE_VENV"):
+        reqs_hash = get_requirements_hash(Path("requirements.txt"))
+        context.venv_dir = Path(create_new_venv(cache_key=reqs_hash[:16]))
     else:
         context.venv_dir = Path(create_new_venv())
 
@@ -62,36 +80,64 @@ def before_all(context):
     if os.name == "posix":
         bin_dir = Path(context.venv_dir) / "bin"
         path_sep = ":"
+        exe_suffix = ""
     else:
         bin_dir = Path(context.venv_dir) / "Scripts"
         path_sep = ";"
-    context.pip = str(bin_dir / "pip")
-    context.python = str(bin_dir / "python")
-    context.kedro = str(bin_dir / "kedro")
+        exe_suffix = ".exe"
+    # resolve the executables to plain strings once, these are used in every step
+    bin_dir_str = str(bin_dir)
+    context.pip = os.path.join(bin_dir_str, "pip" + exe_suffix)
+    context.python = os.path.join(bin_dir_str, "python" + exe_suffix)
+    context.kedro = os.path.join(bin_dir_str, "kedro" + exe_suffix)
 
     # clone the environment, remove any condas and venvs and insert our venv
     context.env = os.environ.copy()
     path = context.env["PATH"].split(path_sep)
-    path = [p for p in path if not (Path(p).parent / "pyvenv.cfg").is_file()]
-    path = [p for p in path if not (Path(p).parent / "conda-meta").is_dir()]
-    path = [str(bin_dir)] + path
+    path = [bin_dir_str] + [p for p in path if not _is_env_bin_dir(p)]
     context.env["PATH"] = path_sep.join(path)
 
+    # keep downloaded wheels between runs and skip pip's own startup checks
+    context.env["PIP_CACHE_DIR"] = str(E2E_CACHE_DIR / "wheels")
+    context.env["PIP_DISABLE_PIP_VERSION_CHECK"] = "1"
+    context.env["PIP_NO_INPUT"] = "1"
+
     # resolve the requirements using pip-compile from pip-tools due to
     # this bug in pip: https://github.com/pypa/pip/issues/988
-    call([context.python, "-m", "pip", "install", "-U", "pip", "pip-tools"])
-    pip_compile = str(bin_dir / "pip-compile")
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        complied_reqs = str(Path(tmpdirname) / "requirements.txt")
-        call([pip_compile, "requirements.txt", "-o", complied_reqs])
-        call([context.pip, "install", "-r", complied_reqs])
+    # compiled requirements are cached by the hash of `requirements.txt`,
+    # but only for a day, so that new releases of unpinned packages are tested
+    call([context.python, "-m", "pip", "install", "-U", "pip"])
+    reqs_hash = get_requirements_hash(Path("requirements.txt"))
+    compiled_reqs = E2E_CACHE_DIR / "{}.txt".format(reqs_hash)
+    if not _is_fresh(compiled_reqs, COMPILED_REQUIREMENTS_TTL):
+        call([context.pip, "install", "pip-tools"])
+        pip_compile = os.path.join(bin_dir_str, "pip-compile" + exe_suffix)
+        compiled_reqs.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            tmp_reqs = str(Path(tmpdirname) / "requirements.txt")
+            call([pip_compile, "requirements.txt", "-o", tmp_reqs])
+            shutil.copy(tmp_reqs, str(compiled_reqs))
+
+    # install the requirements and the plugin in one go
+    call([context.pip, "install", "-r", str(compiled_reqs), "."])
+
+
+def _is_fresh(path: Path, ttl: int) -> bool:
+    try:
+        return time() - path.stat().st_mtime < ttl
+    except FileNotFoundError:
+        return False
+
 
-    # install the plugin
-    call([context.pip, "install", "."])
+def _is_env_bin_dir(path_entry: str) -> bool:
+    parent = Path(path_entry).parent
+    return (parent / "pyvenv.cfg").is_file() or (parent / "conda-meta").is_dir()
 
 
 def after_all(context):
-    if "E2E_VENV" not in os.environ:
+    # cached venvs are reused by the following runs
+    is_cached = E2E_CACHE_DIR in context.venv_dir.parents
+    if "E2E_VENV" not in os.environ and not is_cached:
         rmtree(context.venv_dir)
     docker_prune()
 
@@ -102,6 +148,8 @@ def before_scenario(context, feature):
 
 
 def after_scenario(context, feature):
+    if getattr(context, "occupied_socket", None):
+        context.occupied_socket.close()
     if "docker" in feature.tags:
         kill_docker_containers(context.project_name)
     docker_prune()
@@ -109,8 +157,11 @@ def after_scenario(context, feature):
 
 
 def rmtree(top: Path):
-    if os.name != "posix":
-        for root, _, files in os.walk(str(top), topdown=False):
-            for name in files:
-                os.chmod(os.path.join(root, name), stat.S_IWUSR)
-    shutil.rmtree(str(top))
+    def _onerror(func, path, exc_info):
+        # read-only files can't be removed on Windows, make them writable
+        if not isinstance(exc_info[1], PermissionError):
+            raise exc_info[1]
+        os.chmod(path, stat.S_IWUSR)
+        func(path)
+
+    shutil.rmtree(str(top), onerror=_onerror)
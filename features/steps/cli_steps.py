@@ -27,7 +27,13 @@
 # limitations under the License.
 
 """Behave step definitions for the cli_scenarios feature."""
-from time import sleep
+import os
+import queue
+import selectors
+import shlex
+import socket
+from threading import Thread
+from time import time
 
 import behave
 import yaml
@@ -35,63 +41,104 @@ from behave import given, then, when
 
 from features.steps.sh_run import ChildTerminatingPopen, run
 from features.steps.util import (
-    TimeoutException,
-    download_url,
-    get_docker_images,
+    download_url_prefix,
+    get_docker_containers,
     kill_docker_containers,
-    timeout,
     wait_for,
+    wait_for_docker_image,
 )
 
+try:
+    from yaml import CSafeDumper as _YamlDumper
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeDumper as _YamlDumper
+
 OK_EXIT_CODE = 0
 
 
-def _read_lines_with_timeout(process_handler, max_lines=100):
+def _read_lines_with_timeout(process_handler, max_lines=100, duration=30):
     """
     We want to read from multiple streams, merge outputs together,
     limiting the number of lines we want.
-    Also don't try for longer than ``timeout`` seconds.
+    Also don't try for longer than ``duration`` seconds.
 
-    NOTE: a nice and easy solution might be implemented
-    with ``fcntl`` and non-blocking read, but it's unix-only.
+    NOTE: ``select`` over non-blocking pipes is unix-only,
+    so on Windows the streams are read by background threads instead.
     """
-    lines = []
-
-    def _read_stdout():
-        # In some cases, if the command dies at start, it will be a string here.
-        stream = process_handler.stdout
-
-        if isinstance(stream, str):
-            lines.extend(stream.split("\n"))
-            return
+    # In some cases, if the command dies at start, it will be a string here.
+    if isinstance(process_handler.stdout, str):
+        return process_handler.stdout
 
-        while len(lines) < max_lines:
-            new_line = stream.readline().decode().strip()
+    streams = (process_handler.stdout, process_handler.stderr)
+    read = _read_with_selector if os.name == "posix" else _read_with_threads
+    buffer = read(streams, max_lines, time() + duration)
+    return buffer.decode("utf-8", "replace")
 
-            if new_line:
-                lines.append(new_line)
 
-            sleep(0.1)
+def _read_with_selector(streams, max_lines: int, end: float) -> bytearray:
+    buffer = bytearray()
+    selector = selectors.DefaultSelector()
+    for stream in streams:
+        os.set_blocking(stream.fileno(), False)
+        selector.register(stream, selectors.EVENT_READ)
 
-    def _read_stderr():
-        while True:
-            new_line = process_handler.stderr.readline().decode().strip()
+    try:
+        while selector.get_map() and buffer.count(b"\n") < max_lines:
+            remaining = end - time()
+            if remaining <= 0:
+                break
+            for key, _ in selector.select(timeout=remaining):
+                if _drain(key.fd, buffer):
+                    selector.unregister(key.fileobj)
+    finally:
+        selector.close()
+    return buffer
+
+
+def _read_with_threads(streams, max_lines: int, end: float) -> bytearray:
+    chunks = queue.Queue()
+
+    def _pump(stream):
+        for chunk in iter(lambda: stream.read1(65536), b""):
+            chunks.put(chunk)
+        chunks.put(None)
+
+    for stream in streams:
+        Thread(target=_pump, args=(stream,), daemon=True).start()
+
+    buffer = bytearray()
+    open_streams = len(streams)
+    while open_streams and buffer.count(b"\n") < max_lines:
+        try:
+            chunk = chunks.get(timeout=max(0, end - time()))
+        except queue.Empty:
+            break
+        if chunk is None:
+            open_streams -= 1
+        else:
+            buffer += chunk
+    return buffer
 
-            if new_line:
-                lines.append(new_line)
 
-    try:
-        timeout(_read_stdout, duration=30)
-    except TimeoutException:
-        pass
+def _drain(fileno: int, buffer: bytearray) -> bool:
+    """
+    Read everything currently available from a non-blocking file descriptor.
 
-    # Read the remaining error logs if any
-    try:
-        timeout(_read_stderr, duration=3)
-    except TimeoutException:
-        pass
+    Args:
+        fileno: File descriptor to read from.
+        buffer: Buffer to append the data to.
 
-    return "\n".join(lines)
+    Returns:
+        True if the end of stream was reached, False otherwise.
+    """
+    while True:
+        try:
+            chunk = os.read(fileno, 65536)
+        except BlockingIOError:
+            return False
+        if not chunk:
+            return True
+        buffer += chunk
 
 
 def _get_docker_ipython_output(context):
@@ -116,7 +163,7 @@ def _check_service_up(context: behave.runner.Context, url: str, string: str):
         url: Url that is to be read.
         string: The string to be checked.
     """
-    data = download_url(url)
+    data = download_url_prefix(url)
 
     try:
         assert context.result.poll() is None
@@ -139,6 +186,7 @@ def create_configuration_file(context):
 
     root_project_dir = context.temp_dir / context.project_name
     context.root_project_dir = root_project_dir
+    context.root_project_dir_str = str(root_project_dir)
     config = {
         "project_name": context.project_name,
         "repo_name": context.project_name,
@@ -147,7 +195,7 @@ def create_configuration_file(context):
         "include_example": True,
     }
     with context.config_file.open("w") as config_file:
-        yaml.dump(config, config_file, default_flow_style=False)
+        yaml.dump(config, config_file, Dumper=_YamlDumper, default_flow_style=False)
 
 
 @given("I run a non-interactive kedro new")
@@ -164,7 +212,7 @@ def exec_make_target_checked(context, command):
     """Execute Makefile target"""
     make_cmd = [context.kedro] + command.split()
 
-    res = run(make_cmd, env=context.env, cwd=str(context.root_project_dir))
+    res = run(make_cmd, env=context.env, cwd=context.root_project_dir_str)
 
     if res.returncode != OK_EXIT_CODE:
         print(res.stdout)
@@ -172,6 +220,12 @@ def exec_make_target_checked(context, command):
         assert False
 
 
+@given('I have prepared a batch file "{filename}" with:')
+def create_batch_file(context, filename):
+    """Write the text of the step into a file in the project directory"""
+    (context.root_project_dir / filename).write_text(context.text)
+
+
 @given("I have removed old docker image of test project")
 def remove_old_docker_images(context):
     """Remove old docker images of project"""
@@ -181,27 +235,26 @@ def remove_old_docker_images(context):
 @when('I execute the kedro command "{command}"')
 def exec_kedro_target(context, command):
     """Execute Kedro target"""
-    split_command = command.split()
+    split_command = shlex.split(command)
     make_cmd = [context.kedro] + split_command
 
     if split_command[0] == "docker" and split_command[1] in ("ipython", "jupyter"):
         context.result = ChildTerminatingPopen(
-            make_cmd, env=context.env, cwd=str(context.root_project_dir)
+            make_cmd, env=context.env, cwd=context.root_project_dir_str
         )
     else:
         context.result = run(
-            make_cmd, env=context.env, cwd=str(context.root_project_dir)
+            make_cmd, env=context.env, cwd=context.root_project_dir_str
         )
 
 
 @when('I occupy port "{port}"')
 def occupy_port(context, port):
-    """Execute  target"""
-    ChildTerminatingPopen(
-        ["nc", "-l", "0.0.0.0", port],
-        env=context.env,
-        cwd=str(context.root_project_dir),
-    )
+    """Listen on the given port until the end of the scenario"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("0.0.0.0", int(port)))
+    sock.listen(1)
+    context.occupied_socket = sock
 
 
 @then('I should get a message including "{msg}"')
@@ -254,6 +307,13 @@ def check_failed_status_code(context):
         )
 
 
+@then('A docker container "{name}" should be running')
+def check_docker_container_running(context, name):
+    """Check that a docker container with the given name is running"""
+    # pylint: disable=unused-argument
+    assert get_docker_containers(name), "Container `{}` is not running".format(name)
+
+
 @then('I should see messages from docker ipython startup including "{msg}"')
 def check_docker_ipython_msg(context, msg):
     stdout = _get_docker_ipython_output(context)
@@ -287,11 +347,4 @@ def check_jupyter_nb_proc_on_port(context: behave.runner.Context, port: int):
 @then("A new docker image for test project should be created")
 def check_docker_project_created(context):
     """Check that docker image for test project has been created"""
-
-    def _check_image():
-        while True:
-            if get_docker_images(context.project_name):
-                return True
-            sleep(0.5)
-
-    assert timeout(_check_image, duration=30)
+    assert wait_for_docker_image(context.project_name, timeout_=30)
@@ -26,6 +26,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import shlex
 import subprocess
 from typing import Sequence, Union
@@ -96,6 +97,10 @@ class ChildTerminatingPopen(subprocess.Popen):
             **kwargs: keyword arguments such as env and cwd
 
         """
+        if os.name == "posix":
+            # file descriptors opened by Python are non-inheritable (PEP 446),
+            # so skip closing every possible descriptor in the child
+            kwargs.setdefault("close_fds", False)
         super(ChildTerminatingPopen, self).__init__(
             cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs
         )
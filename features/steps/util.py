@@ -27,20 +27,32 @@
 # limitations under the License.
 
 """Common functions for e2e testing."""
+import atexit
+import hashlib
+import http.client
+import mmap
 import os
 import subprocess
+import sys
 import tempfile
-import urllib
+import urllib.parse
+import urllib.request
 import venv
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from threading import Thread
 from time import sleep, time
-from typing import Any, Callable, List
+from typing import Any, Callable, Dict, List
 
 import docker
 from kedro.cli.utils import get_pkg_version
 
 PIP_INSTALL_SCRIPT = "https://bootstrap.pypa.io/get-pip.py"
+E2E_CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    / "kedro-docker-e2e"
+)
+
+_DOCKER_CLIENT = None
 
 
 class WaitForException(Exception):
@@ -63,7 +75,9 @@ def wait_for(
         expected_result: Result that is expected. Defaults to None.
         timeout_: Time out in seconds. Defaults to 10.
         print_error: Whether any exceptions raised should be printed. Defaults to False.
-        sleep_for: Execute func every specified number of seconds. Defaults to 1.
+        sleep_for: Maximum number of seconds between func executions. The interval
+            starts small and doubles after each attempt up to this value.
+            Defaults to 1.
         **kwargs: Arguments to be passed to func.
 
     Raises:
@@ -72,6 +86,7 @@ def wait_for(
 
     """
     end = time() + timeout_
+    delay = min(0.025, sleep_for)
     while time() <= end:
         try:
             retval = func(**kwargs)
@@ -82,7 +97,8 @@ def wait_for(
             if retval == expected_result:
                 return None
 
-        sleep(sleep_for)
+        sleep(max(0, min(delay, end - time())))
+        delay = min(delay * 2, sleep_for)
 
     raise WaitForException(
         "func: %s, didn't return '%s' within specified"
@@ -90,77 +106,88 @@ def wait_for(
     )
 
 
-class TimeoutException(Exception):
-    """Exception class for ``timeout()`` function below."""
-
-
-def timeout(func: Callable, duration: int = 10, **kwargs: Any) -> Any:
+def download_url(url: str) -> str:
     """
-    Run specified function until timeout. If success, return the return value
-    of specified function. Otherwise throw TimeoutException.
+    Download and return decoded contents of url.
 
     Args:
-        func: Specified function.
-        duration: Duration for timeout in seconds. Defaults to 10.
-        kwargs: Keyword arguments to be passed to func.
+        url: Url that is to be read.
 
     Returns:
-        Any object.
-
-    Raises:
-         TimeoutException: if func doesn't return finish executing within
-            specified time.
+        Decoded data fetched from url.
     """
-    end = time() + duration
-    result_dict = {}  # just to store return value as side effect
-
-    def wrapper_func():
-        result_dict["result"] = func(**kwargs)
-
-    new_thread = Thread(target=wrapper_func, daemon=True)
-    new_thread.start()
-
-    while time() <= end and new_thread.is_alive():
-        sleep(0.1)
-
-    if "result" not in result_dict:
-        raise TimeoutException(
-            "`{0}` did not finish executing within {1:d} seconds".format(
-                func.__name__, duration
-            )
-        )
-    return result_dict["result"]
+    with urllib.request.urlopen(url) as http_response_obj:
+        return http_response_obj.read().decode()
 
 
-def download_url(url: str) -> str:
+def download_url_prefix(url: str, size: int = 4096, max_redirects: int = 5) -> str:
     """
-    Download and return decoded contents of url.
+    Download and return decoded first bytes of url. Only the required range
+    is requested and the connection is closed as soon as it has been read.
+    Redirects are followed.
 
     Args:
         url: Url that is to be read.
+        size: Number of bytes to read. Defaults to 4096.
+        max_redirects: Maximum number of redirects to follow. Defaults to 5.
 
     Returns:
-        Decoded data fetched from url.
+        Decoded prefix of the data fetched from url.
+
+    Raises:
+        HTTPException: If there are more than `max_redirects` redirects.
     """
-    with urllib.request.urlopen(url) as http_response_obj:
-        return http_response_obj.read().decode()
+    headers = {"Range": "bytes=0-{:d}".format(size - 1), "Connection": "close"}
+    for _ in range(max_redirects + 1):
+        parts = urllib.parse.urlsplit(url)
+        path = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+        connection = http.client.HTTPConnection(parts.hostname, parts.port)
+        try:
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+            location = response.getheader("Location")
+            if response.status in (301, 302, 303, 307, 308) and location:
+                url = urllib.parse.urljoin(url, location)
+                continue
+            return response.read(size).decode("utf-8", "replace")
+        finally:
+            connection.close()
+    raise http.client.HTTPException(
+        "More than {:d} redirects while fetching {}".format(max_redirects, url)
+    )
+
+
+def _create_docker_client(**kwargs) -> docker.client.DockerClient:
+    # otherwise docker on CircleCI fails with an error:
+    # docker.errors.APIError: 400 Client Error: Bad Request ("client version
+    # 1.35 is too new. Maximum supported API version is 1.34")
+    kwargs.setdefault("version", "1.34")
+    return docker.from_env(**kwargs)
+
+
+def _get_docker_client() -> docker.client.DockerClient:
+    global _DOCKER_CLIENT  # pylint: disable=global-statement
+    if _DOCKER_CLIENT is None:
+        _DOCKER_CLIENT = _create_docker_client()
+        atexit.register(_DOCKER_CLIENT.close)
+    return _DOCKER_CLIENT
 
 
 def init_docker_client(**kwargs) -> docker.client.DockerClient:
     """
-    Initialise docker client.
+    Initialise docker client. The client created with default settings
+    is cached and shared between calls, so its connection pool is reused.
 
     Args:
         kwargs: Keyword arguments to be passed to ``docker.from_env()`` call.
+            If provided, a new uncached client is created.
 
     Returns:
         DockerClient object.
     """
-    # otherwise docker on CircleCI fails with an error:
-    # docker.errors.APIError: 400 Client Error: Bad Request ("client version
-    # 1.35 is too new. Maximum supported API version is 1.34")
-    kwargs.setdefault("version", "1.34")
-    return docker.from_env(**kwargs)
+    if kwargs:
+        return _create_docker_client(**kwargs)
+    return _get_docker_client()
 
 
 def get_docker_containers(name: str) -> List[docker.models.containers.Container]:
@@ -173,8 +200,10 @@ def get_docker_containers(name: str) -> List[docker.models.containers.Container]
     Returns:
         List of docker containers.
     """
-    client = init_docker_client()
-    return [c for c in client.containers.list() if name in c.name]
+    client = _get_docker_client()
+    # the daemon treats the name filter as a regex, so double check the matches
+    containers = client.containers.list(filters={"name": name})
+    return [c for c in containers if name in c.name]
 
 
 def kill_docker_containers(name: str):
@@ -185,31 +214,83 @@ def kill_docker_containers(name: str):
         name: Name (or substring) of docker containers.
     """
     containers_to_stop = get_docker_containers(name)
+    if not containers_to_stop:
+        return
 
-    for container in containers_to_stop:
-        container.kill()
+    def _kill(container):
+        try:
+            container.kill()
+        except docker.errors.NotFound:
+            pass  # container is already gone
+
+    # each kill is a blocking HTTP request to the daemon, so overlap them
+    max_workers = min(8, len(containers_to_stop))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(_kill, containers_to_stop))
 
 
 def docker_prune():
     """Prunes docker images and containers"""
-    client = init_docker_client()
+    client = _get_docker_client()
     client.containers.prune()
     client.images.prune()
 
 
-def get_docker_images(name: str) -> List[docker.models.images.Image]:
+def get_docker_images(name: str) -> List[Dict[str, Any]]:
     """
-    Get docker images with `name` in their names.
+    Get docker images with `name` in their names. Unlike a plain substring
+    check, only repositories without a `/` are matched, so images such as
+    `registry/name` are not found.
 
     Args:
         name: Name (or substring) of docker images.
 
     Returns:
-        List of docker images.
+        List of docker image records as returned by the Docker API.
+
+    """
+    client = _get_docker_client()
+    # the low-level API returns plain records without inspecting every image;
+    # the reference filter is a glob whose `*` doesn't match `/`, so images
+    # in a registry or namespace are excluded by the daemon. The tag check
+    # below only drops any remaining false positives, it can't bring those
+    # images back
+    images = client.api.images(filters={"reference": "*{}*".format(name)})
+    return [i for i in images if any(name in t for t in i.get("RepoTags") or [])]
 
+
+def wait_for_docker_image(name: str, timeout_: int = 30) -> bool:
     """
-    client = init_docker_client()
-    return [i for i in client.images.list() if any(name in t for t in i.tags)]
+    Wait until a docker image with `name` in its tags exists. Instead of
+    polling the image list, this subscribes to image ``tag`` events which
+    are pushed by the Docker daemon.
+
+    Args:
+        name: Name (or prefix) of the docker image.
+        timeout_: Time out in seconds. Defaults to 30.
+
+    Returns:
+        True if the image exists or has been tagged within the timeout,
+        False otherwise.
+    """
+    start = int(time())
+    # events are replayed from ``start``, so an image tagged between
+    # the listing below and the subscription is not missed
+    if get_docker_images(name):
+        return True
+
+    events = _get_docker_client().events(
+        since=start,
+        until=start + timeout_,
+        filters={"type": "image", "event": "tag"},
+        decode=True,
+    )
+    for event in events:
+        image_name = event.get("Actor", {}).get("Attributes", {}).get("name", "")
+        if image_name.startswith(name):
+            events.close()
+            return True
+    return False
 
 
 def modify_kedro_ver(req_file: Path, version: str) -> str:
@@ -224,29 +305,72 @@ def modify_kedro_ver(req_file: Path, version: str) -> str:
     Returns:
         Version of kedro in original project `requirements.txt`
     """
-    project_reqs = req_file.read_text("utf-8")
     org_version = get_pkg_version(req_file, "kedro")
+
+    if len(version) == len(org_version):
+        # same length versions can be patched in place
+        old_bytes, new_bytes = org_version.encode(), version.encode()
+        with req_file.open("r+b") as req_obj, mmap.mmap(req_obj.fileno(), 0) as mem:
+            idx = mem.find(old_bytes)
+            while idx != -1:
+                mem[idx : idx + len(new_bytes)] = new_bytes
+                idx = mem.find(old_bytes, idx + len(new_bytes))
+        return org_version
+
+    project_reqs = req_file.read_text("utf-8")
     project_reqs = project_reqs.replace(org_version, version)
     req_file.write_text(project_reqs)
     return org_version
 
 
-def create_new_venv() -> str:
+def get_requirements_hash(req_file: Path) -> str:
     """
-    Create a new venv.
+    Compute a cache key for the given requirements file. The key also depends
+    on the running Python version, since requirements resolve differently
+    across versions.
+
+    Args:
+        req_file: Path to the requirements file.
+
+    Returns:
+        Hex digest of the requirements file contents and Python version.
+    """
+    digest = hashlib.sha256(req_file.read_bytes())
+    digest.update(sys.version.encode())
+    return digest.hexdigest()
+
+
+def create_new_venv(cache_key: str = None) -> str:
+    """
+    Create a new venv. If ``cache_key`` is given, the venv is created in the
+    e2e cache directory and reused by the following calls with the same key.
     Note: Due to a bug in Python 3.5 pip needs to be manually installed.
 
+    Args:
+        cache_key: Key identifying a cached venv. A new temporary venv
+            is created if not provided.
+
     Returns:
         Path to created venv.
     """
-    # Create venv
-    venv_dir = tempfile.mkdtemp()
-    venv.main([venv_dir, "--without-pip"])
+    if cache_key:
+        venv_dir = E2E_CACHE_DIR / "venv-{}".format(cache_key)
+    else:
+        venv_dir = Path(tempfile.mkdtemp())
 
     if os.name == "posix":
-        python_executable = Path(venv_dir) / "bin" / "python"
+        python_executable = venv_dir / "bin" / "python"
+        pip_executable = venv_dir / "bin" / "pip"
     else:
-        python_executable = Path(venv_dir) / "Scripts" / "python.exe"
+        python_executable = venv_dir / "Scripts" / "python.exe"
+        pip_executable = venv_dir / "Scripts" / "pip.exe"
+
+    # pip is installed last, so its presence marks a complete venv
+    if pip_executable.is_file():
+        return str(venv_dir)
+
+    # Create venv
+    venv.main([str(venv_dir), "--clear", "--without-pip"])
 
     # Download and run pip installer
     # Windows blocks access unless delete set to False
@@ -257,4 +381,4 @@ def create_new_venv() -> str:
         subprocess.check_call([str(python_executable), tmp_file.name])
 
     os.unlink(tmp_file.name)
-    return venv_dir
+    return str(venv_dir)
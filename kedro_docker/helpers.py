@@ -28,40 +28,137 @@
 
 """ Utilities for use with click docker commands """
 
+import asyncio
+import errno
+import json
 import os
 import re
 import shutil
 import socket
 import subprocess
+import sys
+from functools import lru_cache
 from importlib import import_module
 from itertools import chain
 from pathlib import Path, PurePosixPath
-from subprocess import DEVNULL, PIPE
+from subprocess import DEVNULL
 from typing import List, Sequence, Tuple, Union
 
 from click import secho
 from kedro.cli.utils import KedroCliError
 
+DOCKER_SOCKET_PATH = "/var/run/docker.sock"
+NSSWITCH_CONF_PATH = "/etc/nsswitch.conf"
+PASSWD_PATH = "/etc/passwd"
+BUILDKIT_MIN_VERSION = (18, 9)
+
+_INVALID_CONTAINER_NAME_CHARS = re.compile(r"[^a-zA-Z0-9_.-]+")
+_DOCKER_VERSION = re.compile(r"(\d+)\.(\d+)")
+_PING_REQUEST = b"GET /_ping HTTP/1.1\r\nHost: docker\r\nConnection: close\r\n\r\n"
+
+
+def _ping_docker_daemon() -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as _s:
+        _s.settimeout(0.25)
+        _s.connect(DOCKER_SOCKET_PATH)
+        _s.sendall(_PING_REQUEST)
+        response = _s.recv(64)
+    return b" 200 " in response.split(b"\r\n", 1)[0]
+
+
+def _uses_default_daemon() -> bool:
+    """Check that the Docker CLI is not configured to talk to another daemon."""
+    if "DOCKER_HOST" in os.environ or "DOCKER_CONTEXT" in os.environ:
+        return False
+    config_dir = os.environ.get("DOCKER_CONFIG") or os.path.join(
+        os.path.expanduser("~"), ".docker"
+    )
+    try:
+        with open(os.path.join(config_dir, "config.json")) as config_file:
+            context = json.load(config_file).get("currentContext")
+    except (OSError, ValueError):
+        return True
+    return context in (None, "", "default")
+
+
+@lru_cache(maxsize=1)
+def is_docker_running() -> bool:
+    """
+    Check that the Docker daemon is up and running. On POSIX systems the
+    daemon is pinged directly through its default unix socket if possible,
+    which avoids spawning the `docker` CLI, otherwise `docker version`
+    is called. The result is cached for the lifetime of the process.
+
+    Returns:
+        True if the Docker daemon is running, False otherwise.
+    """
+    # the socket can only be trusted if the CLI would talk to it too
+    if os.name == "posix" and _uses_default_daemon():
+        try:
+            if _ping_docker_daemon():
+                return True
+        except OSError:
+            pass
+
+    try:
+        res = subprocess.run(["docker", "version"], stdout=DEVNULL, stderr=DEVNULL)
+    except FileNotFoundError:
+        return False
+    return not res.returncode
+
+
+def _parse_docker_version(version: str) -> Tuple[int, ...]:
+    match = _DOCKER_VERSION.match(version)
+    return tuple(int(part) for part in match.groups()) if match else (0, 0)
+
 
-def check_docker_image_exists(image: str):
+@lru_cache(maxsize=1)
+def is_buildkit_supported() -> bool:
     """
-    Check that the specified Docker image exists locally.
+    Check that both the Docker CLI and the daemon are recent enough
+    (18.09 or later) to build images with BuildKit. The result is cached
+    for the lifetime of the process.
+
+    Returns:
+        True if BuildKit can be used, False otherwise.
+    """
+    command = [
+        "docker",
+        "version",
+        "--format={{.Client.Version}} {{.Server.Version}}",
+    ]
+    res = subprocess.run(command, stdout=subprocess.PIPE, stderr=DEVNULL)
+    versions = res.stdout.decode().split()
+    if res.returncode or len(versions) != 2:
+        return False
+    return all(_parse_docker_version(ver) >= BUILDKIT_MIN_VERSION for ver in versions)
+
+
+@lru_cache(maxsize=128)
+def check_docker_image_exists(image: str) -> bool:
+    """
+    Check that the specified Docker image exists locally. Successful checks
+    are cached for the lifetime of the process.
 
     Args:
         image: Docker image name.
 
+    Returns:
+        True if the image exists.
+
     Raises:
         KedroCliError: If specified Docker image was not found.
 
     """
-    command = ["docker", "images", "-q", image]
-    res = subprocess.run(command, stdout=PIPE, stderr=DEVNULL)
-    if not res.stdout:
+    command = ["docker", "image", "inspect", "--format={{.Id}}", image]
+    res = subprocess.run(command, stdout=DEVNULL, stderr=DEVNULL)
+    if res.returncode:
         cmd = "kedro docker build --image {0}".format(image)
         raise KedroCliError(
             "Unable to find image `{0}` locally. Please build it first by running:\n"
             "{1}".format(image, cmd)
         )
+    return True
 
 
 def _list_docker_volumes(host_root: str, container_root: str, volumes: Sequence[str]):
@@ -85,6 +182,15 @@ def _list_docker_volumes(host_root: str, container_root: str, volumes: Sequence[
         yield "-v", str(hpath) + ":" + str(cpath)
 
 
+@lru_cache(maxsize=8)
+def _docker_volume_args(
+    host_root: str, container_root: str, volumes: Tuple[str, ...]
+) -> Tuple[str, ...]:
+    # the same volumes are mounted by every command, so build the options once
+    vol_gen = _list_docker_volumes(host_root, container_root, volumes)
+    return tuple(chain.from_iterable(vol_gen))
+
+
 # pylint: disable=too-many-arguments
 def compose_docker_run_args(
     host_root: str = None,
@@ -120,6 +226,8 @@ def compose_docker_run_args(
     required_args = required_args or []
     optional_args = optional_args or []
     user_args = user_args or []
+    if not (mount_volumes or required_args or optional_args):
+        return list(user_args)
     split_user_args = {ua.split("=", 1)[0] for ua in user_args}
 
     def _add_args(name_: str, value_: str = None, force_: bool = False) -> List[str]:
@@ -145,8 +253,9 @@ def compose_docker_run_args(
                 "be specified in `compose_docker_run_args` "
                 "call if `mount_volumes` are provided."
             )
-        vol_gen = _list_docker_volumes(host_root, container_root, mount_volumes)
-        combined_args = list(chain.from_iterable(vol_gen))
+        combined_args = list(
+            _docker_volume_args(host_root, container_root, tuple(mount_volumes))
+        )
     else:
         combined_args = []
     for arg_name, arg_value in required_args:
@@ -167,12 +276,35 @@ def make_container_name(image: str, suffix: str = "") -> str:
     Returns:
         Docker container name.
     """
-    name = re.sub(r"[^a-zA-Z0-9_.-]+", "-", image)
+    name = _INVALID_CONTAINER_NAME_CHARS.sub("-", image)
     if suffix:
         name += "-" + str(suffix)
     return name
 
 
+def _copy_file(src: Path, dest: Path):
+    if not sys.platform.startswith("linux"):
+        shutil.copyfile(str(src), str(dest))
+        return
+
+    # copy within the kernel, avoiding the user space read/write loop
+    src_fd = os.open(str(src), os.O_RDONLY)
+    try:
+        dest_fd = os.open(str(dest), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            size = os.fstat(src_fd).st_size
+            offset = 0
+            while offset < size:
+                sent = os.sendfile(dest_fd, src_fd, offset, size - offset)
+                if not sent:
+                    break
+                offset += sent
+        finally:
+            os.close(dest_fd)
+    finally:
+        os.close(src_fd)
+
+
 def copy_template_files(
     project_path: Path,
     template_path: Path,
@@ -193,11 +325,49 @@ def copy_template_files(
         dest = project_path / file_
         if not dest.exists():
             src = template_path / file_
-            shutil.copyfile(str(src), str(dest))
+            _copy_file(src, dest)
             if verbose:
                 secho("Creating `{0}`".format(str(dest)))
 
 
+@lru_cache(maxsize=None)
+def _passwd_files_first(nsswitch_path: str = NSSWITCH_CONF_PATH) -> bool:
+    """Check whether NSS looks users up in local files before other sources."""
+    try:
+        with open(nsswitch_path) as conf:
+            for line in conf:
+                database, _, sources = line.partition("#")[0].partition(":")
+                if database.strip() == "passwd":
+                    return sources.split()[:1] == ["files"]
+    except OSError:
+        pass
+    return False
+
+
+def _read_passwd_gid(uid: int, passwd_path: str = PASSWD_PATH) -> Union[int, None]:
+    """Find the primary group ID of the user in a passwd file."""
+    with open(passwd_path) as passwd:
+        for line in passwd:
+            fields = line.split(":")
+            if len(fields) > 3 and fields[2] == str(uid):
+                return int(fields[3])
+    return None
+
+
+@lru_cache(maxsize=8)
+def _get_primary_gid(uid: int) -> int:
+    # reading the local file avoids NSS lookups through LDAP/SSSD,
+    # the result is the same as long as `files` is the first source
+    if _passwd_files_first():
+        try:
+            gid = _read_passwd_gid(uid)
+        except (OSError, ValueError):
+            gid = None
+        if gid is not None:
+            return gid
+    return import_module("pwd").getpwuid(uid).pw_gid
+
+
 def get_uid_gid(uid: int = None, gid: int = None) -> Tuple[int, int]:
     """
     Get UID and GID to be passed into the Docker container.
@@ -222,11 +392,7 @@ def get_uid_gid(uid: int = None, gid: int = None) -> Tuple[int, int]:
         uid = os.getuid() if os.name == "posix" else _default_uid
 
     if gid is None:
-        gid = (
-            import_module("pwd").getpwuid(uid).pw_gid
-            if os.name == "posix"
-            else _default_gid
-        )
+        gid = _get_primary_gid(uid) if os.name == "posix" else _default_gid
 
     return uid, gid
 
@@ -260,4 +426,39 @@ def is_port_in_use(port: int) -> bool:
         True if port is already in use, False otherwise.
     """
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as _s:
-        return _s.connect_ex(("0.0.0.0", port)) == 0
+        if os.name == "posix":
+            # ignore connections in TIME_WAIT state, only listening sockets
+            # make the bind fail. Windows would allow rebinding a busy port
+            _s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            _s.bind(("", port))
+        except OSError as err:
+            return err.errno == errno.EADDRINUSE
+    return False
+
+
+def run_concurrently(commands: Sequence[Sequence[str]]) -> List[int]:
+    """
+    Run several commands concurrently and wait for all of them to finish.
+
+    Args:
+        commands: Commands to run, each as a list of program arguments.
+
+    Returns:
+        Exit codes of the commands, in the same order as `commands`.
+    """
+
+    async def _run_all():
+        processes = []
+        for cmd in commands:
+            processes.append(await asyncio.create_subprocess_exec(*cmd))
+        return await asyncio.gather(*(proc.wait() for proc in processes))
+
+    # subprocesses are only supported by the proactor event loop on Windows
+    loop = asyncio.ProactorEventLoop() if os.name == "nt" else asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return list(loop.run_until_complete(_run_all()))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
@@ -27,10 +27,13 @@
 # limitations under the License.
 
 """ Kedro plugin for packaging a project with Docker """
+import os
 import shlex
 import subprocess
+import sys
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Tuple, Union
+from typing import Dict, List, Tuple, Union
 
 import click
 from kedro.cli import get_project_context
@@ -42,8 +45,11 @@ from .helpers import (
     compose_docker_run_args,
     copy_template_files,
     get_uid_gid,
+    is_buildkit_supported,
+    is_docker_running,
     is_port_in_use,
     make_container_name,
+    run_concurrently,
 )
 
 NO_DOCKER_MESSAGE = """
@@ -62,8 +68,15 @@ DOCKER_DEFAULT_VOLUMES = (
 DIVE_IMAGE = "wagoodman/dive:latest"
 
 
+@lru_cache(maxsize=4)
+def _get_project_context(key: str):
+    # the project doesn't change while the process is running,
+    # so each key is resolved only once per process
+    return get_project_context(key)
+
+
 def _image_callback(ctx, param, value):  # pylint: disable=unused-argument
-    image = value or str(get_project_context("project_path").name)
+    image = value or str(_get_project_context("project_path").name)
     check_docker_image_exists(image)
     return image
 
@@ -98,17 +111,58 @@ def _make_image_option(**kwargs):
     return click.option("--image", **kwargs)
 
 
+@lru_cache(maxsize=64)
+def _split_docker_args(value: str) -> Tuple[str, ...]:
+    return tuple(shlex.split(value))
+
+
 def _make_docker_args_option(**kwargs):
     defaults = {
         "type": str,
         "default": "",
-        "callback": lambda ctx, param, value: shlex.split(value),
+        "callback": lambda ctx, param, value: (
+            list(_split_docker_args(value)) if value else []
+        ),
         "help": "Optional arguments to be passed to `docker run` command",
     }
     kwargs = dict(defaults, **kwargs)
     return click.option("--docker-args", **kwargs)
 
 
+def _make_session_option(**kwargs):
+    defaults = {
+        "is_flag": True,
+        "default": False,
+        "help": "Run the command in a long-lived session container "
+        "via `docker exec`. The container is started on first use",
+    }
+    kwargs = dict(defaults, **kwargs)
+    return click.option("--session", **kwargs)
+
+
+def _make_step_option(**kwargs):
+    defaults = {
+        "multiple": True,
+        "help": "Command to run in the container, may be repeated. "
+        "The steps run one after another in a single container "
+        "and stop at the first failure",
+    }
+    kwargs = dict(defaults, **kwargs)
+    return click.option("--step", "steps", **kwargs)
+
+
+def _replace_process(command: List[str]):
+    """Replace the current process with the command, so that the
+    Python process doesn't linger while an interactive session runs."""
+    if os.name != "posix":
+        call(command)
+        return
+    click.echo(" ".join(shlex.quote(arg) for arg in command))
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execvp(command[0], command)
+
+
 @click.group(name="Docker")
 def commands():
     """ Kedro plugin for packaging a project with Docker """
@@ -120,14 +174,7 @@ def commands():
 )
 def docker_group():
     """Dockerize your Kedro project."""
-    # check that docker is running
-    try:
-        res = subprocess.run(
-            ["docker", "version"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-        ).returncode
-    except FileNotFoundError:
-        raise KedroCliError(NO_DOCKER_MESSAGE)
-    if res:
+    if not is_docker_running():
         raise KedroCliError(NO_DOCKER_MESSAGE)
 
 
@@ -146,19 +193,25 @@ def docker_group():
     help="Group ID for kedro user inside the container. "
     "Default is the current user's GID",
 )
+@click.option(
+    "--cache-from",
+    type=str,
+    default=None,
+    help="Image to pull and use as a layer cache source for the build",
+)
 @_make_image_option()
 @_make_docker_args_option(
     help="Optional arguments to be passed to `docker build` command"
 )
-def docker_build(uid, gid, image, docker_args):
+def docker_build(uid, gid, cache_from, image, docker_args):
     """Build a Docker image for the project."""
 
     uid, gid = get_uid_gid(uid, gid)
-    project_path = get_project_context("project_path")
+    project_path = _get_project_context("project_path")
     image = image or str(project_path.name)
 
     template_path = Path(__file__).parent / "template"
-    verbose = get_project_context("verbose")
+    verbose = _get_project_context("verbose")
     copy_template_files(
         project_path,
         template_path,
@@ -166,21 +219,39 @@ def docker_build(uid, gid, image, docker_args):
         verbose,
     )
 
+    # use BuildKit unless the user has explicitly configured the builder
+    # or the Docker installation is too old to support it
+    env = os.environ.copy()
+    if "DOCKER_BUILDKIT" not in env and is_buildkit_supported():
+        env["DOCKER_BUILDKIT"] = "1"
+    buildkit = env.get("DOCKER_BUILDKIT", "0").lower() not in ("", "0", "f", "false")
+
+    required_args = [
+        ("--build-arg", "KEDRO_UID={0}".format(uid)),
+        ("--build-arg", "KEDRO_GID={0}".format(gid)),
+    ]
+    # add image tag if only it is not already supplied by the user
+    optional_args = [("-t", image)]
+    if buildkit:
+        # embed cache metadata so the image can be used with `--cache-from`
+        required_args.append(("--build-arg", "BUILDKIT_INLINE_CACHE=1"))
+        optional_args.append(("--progress", "plain"))
+    if cache_from:
+        # the cache image may not exist yet, so ignore pull failures
+        subprocess.run(["docker", "pull", cache_from])
+        required_args.append(("--cache-from", cache_from))
+
     combined_args = compose_docker_run_args(
-        required_args=[
-            ("--build-arg", "KEDRO_UID={0}".format(uid)),
-            ("--build-arg", "KEDRO_GID={0}".format(gid)),
-        ],
-        # add image tag if only it is not already supplied by the user
-        optional_args=[("-t", image)],
+        required_args=required_args,
+        optional_args=optional_args,
         user_args=docker_args,
     )
-    command = ["docker", "build"] + combined_args + [str(project_path)]
-    call(command)
+    command = ["docker", "build", *combined_args, str(project_path)]
+    call(command, env=env)
 
 
 def _mount_info() -> Dict[str, Union[str, Tuple]]:
-    project_path = get_project_context("project_path")
+    project_path = _get_project_context("project_path")
     res = dict(
         host_root=str(project_path),
         container_root="/home/kedro",
@@ -189,45 +260,106 @@ def _mount_info() -> Dict[str, Union[str, Tuple]]:
     return res
 
 
+def _docker_output(*args: str) -> str:
+    res = subprocess.run(
+        ["docker", *args], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    return "" if res.returncode else res.stdout.decode().strip()
+
+
+def _reject_container_name(docker_args: List[str], reason: str):
+    if "--name" in {arg.split("=", 1)[0] for arg in docker_args}:
+        raise KedroCliError(
+            "`--name` cannot be passed in `--docker-args` together with "
+            "{}.".format(reason)
+        )
+
+
+def _ensure_session_container(image: str, docker_args: List[str]) -> str:
+    """Start a long-lived container for the image unless it's already running
+    from the current version of the image."""
+    _reject_container_name(
+        docker_args,
+        "`--session`, the session container is always named after the image",
+    )
+
+    container_name = make_container_name(image, "session")
+    state = _docker_output(
+        "container",
+        "inspect",
+        "--format={{.State.Running}} {{.Image}}",
+        container_name,
+    )
+    if state:
+        image_id = _docker_output("image", "inspect", "--format={{.Id}}", image)
+        if state == "true {}".format(image_id):
+            return container_name
+        # the image has been rebuilt or the container has stopped
+        call(["docker", "rm", "-f", container_name])
+
+    _docker_run_args = compose_docker_run_args(
+        required_args=[("-d", None)],
+        optional_args=[("--rm", None), ("--name", container_name)],
+        user_args=docker_args,
+        **_mount_info()
+    )
+    call(["docker", "run", *_docker_run_args, image, "sleep", "infinity"])
+    return container_name
+
+
+def _make_session_command(
+    image: str, docker_args: List[str], command: List[str], interactive: bool = False
+) -> List[str]:
+    container_name = _ensure_session_container(image, docker_args)
+    exec_args = ["-it"] if interactive else []
+    return ["docker", "exec", *exec_args, container_name, *command]
+
+
 @forward_command(docker_group, "run")
 @_make_image_option(callback=_image_callback)
 @_make_docker_args_option()
-def docker_run(image, docker_args, args):
+@_make_session_option()
+def docker_run(image, docker_args, session, args):
     """Run the pipeline in the Docker container.
     Any extra arguments unspecified in this help
     are passed to `docker run` as is."""
 
-    container_name = make_container_name(image, "run")
-    _docker_run_args = compose_docker_run_args(
-        optional_args=[("--rm", None), ("--name", container_name)],
-        user_args=docker_args,
-        **_mount_info()
-    )
+    if session:
+        command = _make_session_command(image, docker_args, ["kedro", "run", *args])
+    else:
+        container_name = make_container_name(image, "run")
+        _docker_run_args = compose_docker_run_args(
+            optional_args=[("--rm", None), ("--name", container_name)],
+            user_args=docker_args,
+            **_mount_info()
+        )
 
-    command = (
-        ["docker", "run"] + _docker_run_args + [image, "kedro", "run"] + list(args)
-    )
+        command = ["docker", "run", *_docker_run_args, image, "kedro", "run", *args]
     call(command)
 
 
 @forward_command(docker_group, "ipython")
 @_make_image_option(callback=_image_callback)
 @_make_docker_args_option()
-def docker_ipython(image, docker_args, args):
+@_make_session_option()
+def docker_ipython(image, docker_args, session, args):
     """Run ipython in the Docker container.
     Any extra arguments unspecified in this help are passed to
     `kedro ipython` command inside the container as is."""
-    container_name = make_container_name(image, "ipython")
-    _docker_run_args = compose_docker_run_args(
-        optional_args=[("--rm", None), ("-it", None), ("--name", container_name)],
-        user_args=docker_args,
-        **_mount_info()
-    )
+    if session:
+        command = _make_session_command(
+            image, docker_args, ["kedro", "ipython", *args], interactive=True
+        )
+    else:
+        container_name = make_container_name(image, "ipython")
+        _docker_run_args = compose_docker_run_args(
+            optional_args=[("--rm", None), ("-it", None), ("--name", container_name)],
+            user_args=docker_args,
+            **_mount_info()
+        )
 
-    command = (
-        ["docker", "run"] + _docker_run_args + [image, "kedro", "ipython"] + list(args)
-    )
-    call(command)
+        command = ["docker", "run", *_docker_run_args, image, "kedro", "ipython", *args]
+    _replace_process(command)
 
 
 @docker_group.group(name="jupyter")
@@ -251,14 +383,9 @@ def docker_jupyter_notebook(docker_args, port, image, args):
         **_mount_info()
     )
 
-    args = add_jupyter_args(list(args))
-    command = (
-        ["docker", "run"]
-        + _docker_run_args
-        + [image, "kedro", "jupyter", "notebook"]
-        + args
-    )
-    call(command)
+    kedro_command = ["kedro", "jupyter", "notebook", *add_jupyter_args(list(args))]
+    command = ["docker", "run", *_docker_run_args, image, *kedro_command]
+    _replace_process(command)
 
 
 @forward_command(docker_jupyter, "lab")
@@ -278,31 +405,80 @@ def docker_jupyter_lab(docker_args, port, image, args):
         **_mount_info()
     )
 
-    args = add_jupyter_args(list(args))
-    command = (
-        ["docker", "run"] + _docker_run_args + [image, "kedro", "jupyter", "lab"] + args
-    )
-    call(command)
+    kedro_command = ["kedro", "jupyter", "lab", *add_jupyter_args(list(args))]
+    command = ["docker", "run", *_docker_run_args, image, *kedro_command]
+    _replace_process(command)
 
 
 @forward_command(docker_group, "cmd")
 @_make_image_option(callback=_image_callback)
 @_make_docker_args_option()
-def docker_cmd(args, docker_args, image):
+@_make_session_option()
+@_make_step_option()
+def docker_cmd(args, docker_args, image, session, steps):
     """Run arbitrary command from ARGS in the Docker container.
     If ARGS are not specified, this will invoke `kedro run` inside the container."""
 
-    container_name = make_container_name(image, "cmd")
-    _docker_run_args = compose_docker_run_args(
-        optional_args=[("--rm", None), ("--name", container_name)],
-        user_args=docker_args,
-        **_mount_info()
-    )
+    if steps:
+        if args:
+            raise KedroCliError("`--step` options cannot be combined with ARGS.")
+        args = ["sh", "-c", " && ".join(steps)]
 
-    command = ["docker", "run"] + _docker_run_args + [image] + list(args)
+    if session:
+        command = _make_session_command(
+            image, docker_args, list(args) or ["kedro", "run"]
+        )
+    else:
+        container_name = make_container_name(image, "cmd")
+        _docker_run_args = compose_docker_run_args(
+            optional_args=[("--rm", None), ("--name", container_name)],
+            user_args=docker_args,
+            **_mount_info()
+        )
+
+        command = ["docker", "run", *_docker_run_args, image, *args]
     call(command)
 
 
+def _read_batch_file(batch_file: str) -> List[List[str]]:
+    with open(batch_file, encoding="utf-8") as file_:
+        lines = (shlex.split(line, comments=True) for line in file_)
+        return [args for args in lines if args]
+
+
+@docker_group.command(name="batch")
+@click.argument("batch_file", type=click.Path(exists=True, dir_okay=False))
+@_make_image_option(callback=_image_callback)
+@_make_docker_args_option()
+def docker_batch(batch_file, image, docker_args):
+    """Run commands from BATCH_FILE concurrently in Docker containers.
+    Each non-empty line of BATCH_FILE is a command to run in its own
+    container, as for `kedro docker cmd`. Text after `#` is ignored."""
+    _reject_container_name(
+        docker_args, "`kedro docker batch`, each container is named after its line"
+    )
+    batch = _read_batch_file(batch_file)
+    batch_commands = []
+    for idx, args in enumerate(batch):
+        container_name = make_container_name(image, "batch-{}".format(idx))
+        _docker_run_args = compose_docker_run_args(
+            optional_args=[("--rm", None), ("--name", container_name)],
+            user_args=docker_args,
+            **_mount_info()
+        )
+        batch_commands.append(["docker", "run", *_docker_run_args, image, *args])
+
+    for command in batch_commands:
+        click.echo(" ".join(shlex.quote(arg) for arg in command))
+    exit_codes = run_concurrently(batch_commands)
+
+    failed = [" ".join(args) for args, code in zip(batch, exit_codes) if code]
+    if failed:
+        raise KedroCliError(
+            "The following commands have failed:\n{}".format("\n".join(failed))
+        )
+
+
 @docker_group.command(name="dive")
 @click.option(
     "--ci/--no-ci",
@@ -344,5 +520,5 @@ def docker_dive(ci_flag, dive_ci, docker_args, image):
         required_args=required_args, optional_args=optional_args, user_args=docker_args
     )
 
-    command = ["docker", "run"] + _docker_run_args + [DIVE_IMAGE] + [image]
+    command = ["docker", "run", *_docker_run_args, DIVE_IMAGE, image]
     call(command)
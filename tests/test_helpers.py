@@ -26,31 +26,56 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import errno
+import json
+import sys
 from pathlib import Path
 
 from click import ClickException
-from pytest import mark, raises
+from pytest import fixture, mark, raises
 
 from kedro_docker.helpers import (
+    _docker_volume_args,
+    _get_primary_gid,
+    _passwd_files_first,
+    _ping_docker_daemon,
+    _read_passwd_gid,
+    _uses_default_daemon,
     add_jupyter_args,
     check_docker_image_exists,
     compose_docker_run_args,
     copy_template_files,
     get_uid_gid,
+    is_buildkit_supported,
+    is_docker_running,
     is_port_in_use,
     make_container_name,
+    run_concurrently,
 )
 
 
 def test_missing_docker_image(mocker):
     """Check the error raised when docker image is missing"""
     patched_subproc = mocker.patch("subprocess.run")
-    patched_subproc.return_value.stdout = b""
+    patched_subproc.return_value.returncode = 1
     image_name = "image-name"
     pattern = "Unable to find image `{}` locally".format(image_name)
     with raises(ClickException, match=pattern):
         check_docker_image_exists(image_name)
     assert patched_subproc.call_count == 1
+    command = patched_subproc.call_args[0][0]
+    assert command == ["docker", "image", "inspect", "--format={{.Id}}", image_name]
+
+
+def test_docker_image_exists_cached(mocker):
+    """Check that docker is only called once for an existing image"""
+    patched_subproc = mocker.patch("subprocess.run")
+    patched_subproc.return_value.returncode = 0
+    image_name = "cached-image-name"
+    assert check_docker_image_exists(image_name)
+    assert check_docker_image_exists(image_name)
+    assert patched_subproc.call_count == 1
+    check_docker_image_exists.cache_clear()
 
 
 @mark.parametrize(
@@ -98,6 +123,33 @@ class TestComposeDockerRunArgs:
         expected += kwargs["user_args"]
         assert compose_docker_run_args(**kwargs) == expected
 
+    def test_mount_cached(self, tmp_path, mocker):
+        """Test that volume options are only built once for the same volumes"""
+        _docker_volume_args.cache_clear()
+        patched_list = mocker.patch(
+            "kedro_docker.helpers._list_docker_volumes",
+            return_value=[("-v", "/a:/b/a")],
+        )
+        kwargs = dict(
+            host_root=str(tmp_path),
+            container_root="/b",
+            mount_volumes=["a"],
+            user_args=["-v", "y1"],
+        )
+        expected = ["-v", "/a:/b/a", "-v", "y1"]
+        assert compose_docker_run_args(**kwargs) == expected
+        assert compose_docker_run_args(**kwargs) == expected
+        assert patched_list.call_count == 1
+        _docker_volume_args.cache_clear()
+
+    def test_user_args_only(self):
+        """Test that user arguments are copied as is if nothing else is given"""
+        user_args = ["-v", "y1", "--rm"]
+        result = compose_docker_run_args(user_args=user_args)
+        assert result == user_args
+        assert result is not user_args
+        assert compose_docker_run_args() == []
+
     @mark.parametrize("host_root", ["host_root", None])
     @mark.parametrize("container_root", ["container_root", None])
     def test_bad_mount(self, host_root, container_root):
@@ -125,7 +177,26 @@ class TestCopyTemplateFiles:
         dest_file = tmp_path / this_file.name
         assert not dest_file.exists()
         copy_template_files(tmp_path, this_file.parent, [this_file.name], True)
-        assert dest_file.exists()
+        assert dest_file.read_bytes() == this_file.read_bytes()
+
+    def test_copy_not_linux(self, tmp_path, mocker):
+        """Test copying template files on platforms without `sendfile` support"""
+        mocker.patch("sys.platform", new="win32")
+        patched_copy = mocker.patch("shutil.copyfile")
+        this_file = Path(__file__)
+        copy_template_files(tmp_path, this_file.parent, [this_file.name])
+        patched_copy.assert_called_once_with(
+            str(this_file.parent / this_file.name), str(tmp_path / this_file.name)
+        )
+
+    def test_copy_truncated_source(self, tmp_path, mocker):
+        """Test that copying stops if the source file gets shorter"""
+        mocker.patch("sys.platform", new="linux")
+        patched_sendfile = mocker.patch("os.sendfile", return_value=0)
+        this_file = Path(__file__)
+        copy_template_files(tmp_path, this_file.parent, [this_file.name])
+        assert patched_sendfile.call_count == 1
+        assert (tmp_path / this_file.name).read_bytes() == b""
 
     def test_skip(self, tmp_path):
         """Test copying is skipped if destination path already exists"""
@@ -139,6 +210,13 @@ class TestCopyTemplateFiles:
 
 
 class TestGetUidGid:
+    @fixture(autouse=True)
+    def no_passwd_file(self, mocker):
+        mocker.patch("kedro_docker.helpers._passwd_files_first", return_value=False)
+        _get_primary_gid.cache_clear()
+        yield
+        _get_primary_gid.cache_clear()
+
     @mark.parametrize(
         "uid, gid, expected",
         [
@@ -171,6 +249,55 @@ class TestGetUidGid:
         mocker.patch("os.name", new="windows")
         assert get_uid_gid(uid, gid) == expected
 
+    def test_passwd_file(self, mocker):
+        """Test that the primary group is read from the passwd file if possible"""
+        mocker.patch("os.name", new="posix")
+        mocker.patch("kedro_docker.helpers._passwd_files_first", return_value=True)
+        mocker.patch("kedro_docker.helpers._read_passwd_gid", return_value=789)
+        patched_getpwuid = mocker.patch("pwd.getpwuid")
+        assert get_uid_gid(3, None) == (3, 789)
+        patched_getpwuid.assert_not_called()
+
+    def test_passwd_file_unreadable(self, mocker):
+        """Test falling back to `pwd` if the passwd file can't be read"""
+        mocker.patch("os.name", new="posix")
+        mocker.patch("kedro_docker.helpers._passwd_files_first", return_value=True)
+        mocker.patch(
+            "kedro_docker.helpers._read_passwd_gid", side_effect=OSError("denied")
+        )
+        mocker.patch("pwd.getpwuid").return_value.pw_gid = 456
+        assert get_uid_gid(3, None) == (3, 456)
+
+    def test_read_passwd_gid(self, tmp_path):
+        """Test parsing of the passwd file"""
+        passwd = tmp_path / "passwd"
+        passwd.write_text(
+            "root:x:0:0:root:/root:/bin/bash\n" "user:x:1000:1001::/home/user:/bin/sh\n"
+        )
+        assert _read_passwd_gid(1000, str(passwd)) == 1001
+        assert _read_passwd_gid(1001, str(passwd)) is None
+
+    @mark.parametrize(
+        "config, expected",
+        [
+            ("passwd: files\n", True),
+            ("group: files\npasswd:   files systemd # local\n", True),
+            ("passwd: sss files\n", False),
+            ("passwd: compat\n", False),
+            ("group: files\n", False),
+        ],
+    )
+    def test_passwd_files_first(self, config, expected, tmp_path):
+        """Test parsing of the NSS configuration"""
+        nsswitch = tmp_path / "nsswitch.conf"
+        nsswitch.write_text(config)
+        assert _passwd_files_first.__wrapped__(str(nsswitch)) == expected
+
+    def test_no_nsswitch_conf(self, tmp_path):
+        """Test that a missing NSS configuration disables the passwd file"""
+        missing = str(tmp_path / "nsswitch.conf")
+        assert _passwd_files_first.__wrapped__(missing) is False
+
 
 @mark.parametrize(
     "run_args, expected",
@@ -192,8 +319,132 @@ def test_add_jupyter_args(run_args, expected):
 
 
 @mark.parametrize("port", [8888, 98765, 80, 8080])
-@mark.parametrize("mock_return_value, expected", [(0, True), (61, False)])
-def test_is_port_in_use(mocker, port, mock_return_value, expected):
-    _mock = mocker.patch("socket.socket.connect_ex", return_value=mock_return_value)
+@mark.parametrize(
+    "bind_error, expected",
+    [
+        (OSError(errno.EADDRINUSE, "Address already in use"), True),
+        (OSError(errno.EACCES, "Permission denied"), False),
+        (None, False),
+    ],
+)
+def test_is_port_in_use(mocker, port, bind_error, expected):
+    _mock = mocker.patch("socket.socket.bind", side_effect=bind_error)
     assert is_port_in_use(port) is expected
-    _mock.assert_called_once_with(("0.0.0.0", port))
+    _mock.assert_called_once_with(("", port))
+
+
+class TestIsBuildkitSupported:
+    @fixture(autouse=True)
+    def clear_cache(self):
+        is_buildkit_supported.cache_clear()
+        yield
+        is_buildkit_supported.cache_clear()
+
+    @mark.parametrize(
+        "returncode, output, expected",
+        [
+            (0, b"19.03.5 18.09.7\n", True),
+            (0, b"18.09.0 17.12.0-ce\n", False),
+            (0, b"17.09.1-ce 19.03.5\n", False),
+            (0, b"20.10.7 \n", False),
+            (1, b"", False),
+        ],
+    )
+    def test_versions(self, mocker, returncode, output, expected):
+        """Test checking the Docker client and server versions"""
+        patched_subproc = mocker.patch("subprocess.run")
+        patched_subproc.return_value.returncode = returncode
+        patched_subproc.return_value.stdout = output
+        assert is_buildkit_supported() is expected
+        assert patched_subproc.call_args[0][0][:2] == ["docker", "version"]
+
+
+class TestIsDockerRunning:
+    @fixture(autouse=True)
+    def clear_cache(self, monkeypatch, mocker, tmp_path):
+        monkeypatch.delenv("DOCKER_HOST", raising=False)
+        monkeypatch.delenv("DOCKER_CONTEXT", raising=False)
+        monkeypatch.setenv("DOCKER_CONFIG", str(tmp_path))
+        mocker.patch("os.name", new="posix")
+        is_docker_running.cache_clear()
+        yield
+        is_docker_running.cache_clear()
+
+    def test_socket(self, mocker):
+        """Test that the CLI is not called if the daemon socket responds"""
+        mocker.patch("kedro_docker.helpers._ping_docker_daemon", return_value=True)
+        patched_subproc = mocker.patch("subprocess.run")
+        assert is_docker_running()
+        patched_subproc.assert_not_called()
+
+    @mark.parametrize("returncode, expected", [(0, True), (1, False)])
+    def test_cli_fallback(self, mocker, returncode, expected):
+        """Test falling back to the CLI if the daemon socket is unavailable"""
+        mocker.patch(
+            "kedro_docker.helpers._ping_docker_daemon", side_effect=OSError("no daemon")
+        )
+        patched_subproc = mocker.patch("subprocess.run")
+        patched_subproc.return_value.returncode = returncode
+        assert is_docker_running() is expected
+        assert patched_subproc.call_count == 1
+
+    def test_no_docker_cli(self, mocker):
+        """Check the result when `docker` CLI is not installed"""
+        mocker.patch("kedro_docker.helpers._ping_docker_daemon", return_value=False)
+        mocker.patch("subprocess.run", side_effect=FileNotFoundError)
+        assert not is_docker_running()
+
+    def test_docker_host(self, mocker, monkeypatch):
+        """Test that the default socket is skipped if `DOCKER_HOST` is set"""
+        monkeypatch.setenv("DOCKER_HOST", "tcp://127.0.0.1:2375")
+        patched_ping = mocker.patch("kedro_docker.helpers._ping_docker_daemon")
+        patched_subproc = mocker.patch("subprocess.run")
+        patched_subproc.return_value.returncode = 0
+        assert is_docker_running()
+        patched_ping.assert_not_called()
+
+    @mark.parametrize("context, expected", [("default", True), ("remote", False)])
+    def test_docker_context_config(self, context, expected, tmp_path):
+        """Test that the default socket is skipped if a context is selected"""
+        config = {"auths": {}, "currentContext": context}
+        (tmp_path / "config.json").write_text(json.dumps(config))
+        assert _uses_default_daemon() is expected
+
+    def test_windows(self, mocker):
+        """Test that the CLI is always used on Windows"""
+        mocker.patch("os.name", new="nt")
+        patched_ping = mocker.patch("kedro_docker.helpers._ping_docker_daemon")
+        patched_subproc = mocker.patch("subprocess.run")
+        patched_subproc.return_value.returncode = 0
+        assert is_docker_running()
+        patched_ping.assert_not_called()
+
+    @mark.parametrize(
+        "response, expected",
+        [(b"HTTP/1.1 200 OK\r\nApi-Version: 1.40", True), (b"HTTP/1.1 500 ", False)],
+    )
+    def test_ping(self, mocker, response, expected):
+        """Test pinging the daemon through its unix socket"""
+        patched_socket = mocker.patch("socket.socket")
+        sock = patched_socket.return_value.__enter__.return_value
+        sock.recv.return_value = response
+        assert _ping_docker_daemon() is expected
+        sock.connect.assert_called_once_with("/var/run/docker.sock")
+
+    def test_cached(self, mocker):
+        """Test that the daemon is only checked once"""
+        mocker.patch("kedro_docker.helpers._ping_docker_daemon", return_value=False)
+        patched_subproc = mocker.patch("subprocess.run")
+        patched_subproc.return_value.returncode = 0
+        assert is_docker_running()
+        assert is_docker_running()
+        assert patched_subproc.call_count == 1
+
+
+def test_run_concurrently():
+    """Test that exit codes are returned in the order of the commands"""
+    commands = [
+        [sys.executable, "-c", "import sys; sys.exit({})".format(code)]
+        for code in (0, 3, 0)
+    ]
+    assert run_concurrently(commands) == [0, 3, 0]